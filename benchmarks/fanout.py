@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2018, DIANA-HEP
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Update latency and fan-out throughput of vegascope, without a web browser.
+
+A Canvas (or LocalCanvas) runs in this process and a child process attaches simulated web browsers to it: plain
+sockets reading /update (and /data, once per dataset, like a browser's cache). Graphics are sent at a fixed rate
+for each combination of data size, rate, and number of clients, and every graphic carries the time it was sent, so
+the clients can measure how long it took to reach them. Results are written as JSON lines, one per combination,
+after a line describing the machine; two result files can be compared with --compare.
+
+    python benchmarks/fanout.py --sizes 10 10000 --rates 1 10 --clients 1 100 --output before.json
+    python benchmarks/fanout.py --sizes 10 10000 --rates 1 10 --clients 1 100 --output after.json
+    python benchmarks/fanout.py --compare before.json after.json
+
+Everything runs on localhost (nothing is downloaded) and needs only the standard library on Linux.
+"""
+
+from __future__ import print_function
+
+import argparse
+import gc
+import json
+import os
+import platform
+import re
+import resource
+import select
+import socket
+import subprocess
+import sys
+import threading
+import time
+import zlib
+
+if sys.version_info[0] <= 2:
+    from urllib2 import urlopen, Request
+else:
+    from urllib.request import urlopen, Request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import vegascope
+
+marker = re.compile(br"vegascope-benchmark (\d+) ([0-9.]+)")
+dataurl = re.compile(br"/data/[0-9a-f]{40}")
+
+def rss():
+    # resident memory of this process in bytes (Linux), without garbage that hasn't been collected yet
+    gc.collect()
+    with open("/proc/self/statm") as file:
+        return int(file.read().split()[1]) * resource.getpagesize()
+
+def cpu():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def percentiles(latencies):
+    if len(latencies) == 0:
+        return None
+    latencies = sorted(latencies)
+    def at(p):
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+    return {"p50": at(0.50), "p90": at(0.90), "p99": at(0.99), "max": latencies[-1], "mean": sum(latencies) / len(latencies)}
+
+def spec(rows, sequence):
+    # a Vega-Lite scatter plot; the description says which graphic this is and when it was sent
+    return {"$schema": "https://vega.github.io/schema/vega-lite/v3.json",
+            "description": "vegascope-benchmark {0} {1!r}".format(sequence, time.time()),
+            "data": {"values": rows},
+            "mark": "point",
+            "encoding": {"x": {"field": "x", "type": "quantitative"}, "y": {"field": "y", "type": "quantitative"}}}
+
+################################################################ simulated web browsers (child process)
+
+class Client(object):
+    # one /update connection, read as a web browser would, but only looking for the graphics' descriptions
+    def __init__(self, port, gzip):
+        self.socket = socket.create_connection(("localhost", port))
+        self.socket.sendall(b"GET /update HTTP/1.1\r\nHost: localhost\r\n" + (b"Accept-Encoding: gzip\r\n" if gzip else b"") + b"\r\n")
+        self.socket.setblocking(False)
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzip else None
+        self.headers = b""
+        self.tail = b""
+        self.ready = False
+        self.last = 0    # the first graphic was sent before the clients connected
+        self.received = 0
+        self.bytes = 0
+        self.latencies = []
+        self.urls = set()
+
+    def read(self, now):
+        try:
+            data = self.socket.recv(1024**2)
+        except socket.error:
+            return False
+        if len(data) == 0:
+            return False
+        self.bytes += len(data)
+        if self.headers is not None:
+            self.headers += data
+            if b"\r\n\r\n" not in self.headers:
+                return True
+            data = self.headers.split(b"\r\n\r\n", 1)[1]
+            self.headers = None
+        if self.decompressor is not None:
+            data = self.decompressor.decompress(data)
+
+        # keep the end of the last chunk, in case a description or URL is split between chunks
+        text = self.tail + data
+        self.tail = text[-200:]
+        if b"\nid: " in text:
+            self.ready = True
+        for m in marker.finditer(text):
+            sequence = int(m.group(1))
+            if sequence > self.last:
+                self.last = sequence
+                self.received += 1
+                self.latencies.append(now - float(m.group(2)))
+        self.urls.update(dataurl.findall(text))
+        return True
+
+def worker(port, count, gzip):
+    # connect count clients, say "ready" when all have their first graphic, read until the parent says which
+    # graphic was the last (or a timeout passes), and print the results as JSON
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < count + 64 <= hard or hard == resource.RLIM_INFINITY:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (max(soft, count + 64), hard))
+
+    clients = {}
+    poll = select.poll()
+    for i in range(count):
+        client = Client(port, gzip)
+        clients[client.socket.fileno()] = client
+        poll.register(client.socket.fileno(), select.POLLIN)
+
+    last = [None]
+    deadline = [None]
+    def control():
+        for line in iter(sys.stdin.readline, ""):
+            sequence, timeout = json.loads(line)
+            deadline[0] = time.time() + timeout
+            last[0] = sequence
+    thread = threading.Thread(target=control)
+    thread.daemon = True
+    thread.start()
+
+    announced = False
+    while True:
+        for fileno, event in poll.poll(100):
+            client = clients[fileno]
+            if not client.read(time.time()):
+                poll.unregister(fileno)
+        if not announced and all(client.ready for client in clients.values()):
+            print("ready")
+            sys.stdout.flush()
+            announced = True
+        if last[0] is not None and (all(client.last >= last[0] for client in clients.values()) or time.time() > deadline[0]):
+            break
+
+    # web browsers download each dataset once; each one's size is measured once and counted for every client
+    sizes = {}
+    for url in set(url for client in clients.values() for url in client.urls):
+        request = Request("http://localhost:{0}{1}".format(port, url.decode("ascii")))
+        if gzip:
+            request.add_header("Accept-Encoding", "gzip")
+        try:
+            sizes[url] = len(urlopen(request).read())
+        except IOError:
+            sizes[url] = 0
+
+    latencies = [x for client in clients.values() for x in client.latencies]
+    result = {"received": sum(client.received for client in clients.values()),
+              "complete": sum(1 for client in clients.values() if client.last >= last[0]),
+              "latency": percentiles(latencies),
+              "streambytes": sum(client.bytes for client in clients.values()),
+              "databytes": sum(sizes[url] for client in clients.values() for url in client.urls)}
+    for client in clients.values():
+        client.socket.close()
+    print(json.dumps(result))
+    sys.stdout.flush()
+
+################################################################ server and driver (this process)
+
+def run(kind, engine, size, rate, count, duration, gzip):
+    rows = [{"x": i, "y": (i * 7919) % 1000} for i in range(size)]
+    if kind == "LocalCanvas":
+        canvas = vegascope.LocalCanvas(initial=spec(rows, 0), verbose=False, newtab=False, engine=engine)
+        gzip = False    # LocalCanvas never compresses
+    else:
+        canvas = vegascope.Canvas(initial=spec(rows, 0), host="localhost", verbose=False, engine=engine)
+
+    try:
+        before = rss()
+        child = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--worker", str(canvas.port), str(count)] + (["--gzip"] if gzip else []), stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True)
+        if child.stdout.readline().strip() != "ready":
+            raise RuntimeError("simulated web browsers did not connect")
+        time.sleep(0.1)
+        perclient = (rss() - before) / float(count)
+
+        # graphics at a steady rate, catching up if a call takes longer than the interval
+        updates = max(1, int(round(rate * duration)))
+        start = time.time()
+        cpustart = cpu()
+        for sequence in range(1, updates + 1):
+            delay = start + (sequence - 1) / float(rate) - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            canvas(spec(rows, sequence))
+        sending = time.time() - start
+
+        child.stdin.write(json.dumps([updates, max(5.0, duration)]) + "\n")
+        child.stdin.flush()
+        result = json.loads(child.stdout.readline())
+        child.wait()
+        elapsed = time.time() - start
+        cpuseconds = cpu() - cpustart
+        stats = canvas.stats
+    finally:
+        canvas.close()
+
+    result.update({"canvas": kind,
+                   "engine": engine,
+                   "gzip": gzip,
+                   "size": size,
+                   "rate": rate,
+                   "clients": count,
+                   "updates": updates,
+                   "achievedrate": updates / sending if sending > 0 else None,
+                   "specbytes": len(json.dumps(spec(rows, updates))),
+                   "delivered": result["received"] / float(updates * count),
+                   "cpuseconds": cpuseconds,
+                   "cpupercent": 100.0 * cpuseconds / elapsed,
+                   "rssperclient": perclient,
+                   "bytesperupdate": (result["streambytes"] + result["databytes"]) / float(updates * count),
+                   "serializeseconds": stats["serializeseconds"] / max(1, stats["graphics"]),
+                   "lockwaitseconds": stats["lockwaitseconds"]})
+    return result
+
+def describe(result):
+    latency = result["latency"] or {}
+    return "{canvas:12s} {engine:9s} size {size:>7d} rate {rate:>5g}/s clients {clients:>5d}: p50 {p50} p99 {p99} delivered {delivered:.0%} cpu {cpupercent:.0f}% {rssperclient:.0f} B/client {bytesperupdate:.0f} B/update".format(
+        p50="{0:.1f} ms".format(1000 * latency["p50"]) if "p50" in latency else "-",
+        p99="{0:.1f} ms".format(1000 * latency["p99"]) if "p99" in latency else "-",
+        **result)
+
+def compare(old, new):
+    # ratios new/old of the main measurements for the combinations that both files have
+    def load(filename):
+        with open(filename) as file:
+            lines = [json.loads(line) for line in file if line.strip()]
+        return dict((tuple(x[k] for k in ("canvas", "engine", "gzip", "size", "rate", "clients")), x) for x in lines if "clients" in x)
+    old, new = load(old), load(new)
+    for key in sorted(set(old) & set(new)):
+        a, b = old[key], new[key]
+        def ratio(x, y):
+            return "{0:6.2f}".format(y / x) if x and y is not None else "     -"
+        print("{0:12s} {1:9s} gzip {2!s:5s} size {3:>7d} rate {4:>5g}/s clients {5:>5d}:".format(*key),
+              "p50", ratio((a["latency"] or {}).get("p50"), (b["latency"] or {}).get("p50")),
+              "p99", ratio((a["latency"] or {}).get("p99"), (b["latency"] or {}).get("p99")),
+              "cpu", ratio(a["cpuseconds"], b["cpuseconds"]),
+              "memory", ratio(a["rssperclient"], b["rssperclient"]),
+              "bytes", ratio(a["bytesperupdate"], b["bytesperupdate"]))
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure vegascope's update latency and fan-out throughput with simulated web browsers.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 100000], help="rows of data in each graphic (default: 10 1000 100000)")
+    parser.add_argument("--rates", type=float, nargs="+", default=[1, 10, 50], help="graphics per second (default: 1 10 50)")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 10, 100], help="simulated web browsers (default: 1 10 100)")
+    parser.add_argument("--engines", nargs="+", default=["threading", "asyncio"] if sys.version_info[0] > 2 else ["threading"], help="web server engines (default: all that this Python has)")
+    parser.add_argument("--canvases", nargs="+", default=["Canvas"], choices=["Canvas", "LocalCanvas"], help="kinds of canvas (default: Canvas)")
+    parser.add_argument("--duration", type=float, default=3.0, help="seconds of updates per combination (default: 3)")
+    parser.add_argument("--gzip", action="store_true", help="simulated web browsers accept gzip (LocalCanvas never compresses)")
+    parser.add_argument("--output", help="write JSON lines to this file (default: standard output)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files instead of running")
+    parser.add_argument("--worker", nargs=2, type=int, metavar=("PORT", "CLIENTS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        return worker(args.worker[0], args.worker[1], args.gzip)
+    if args.compare is not None:
+        return compare(*args.compare)
+
+    output = sys.stdout if args.output is None else open(args.output, "w")
+    try:
+        orjson = __import__("orjson") and True
+    except ImportError:
+        orjson = False
+    output.write(json.dumps({"vegascope": vegascope.__version__, "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count() if hasattr(os, "cpu_count") else None, "orjson": orjson, "duration": args.duration, "time": time.strftime("%Y-%m-%dT%H:%M:%S")}) + "\n")
+    for kind in args.canvases:
+        for engine in args.engines:
+            for size in args.sizes:
+                for rate in args.rates:
+                    for count in args.clients:
+                        result = run(kind, engine, size, rate, count, args.duration, args.gzip)
+                        output.write(json.dumps(result, sort_keys=True) + "\n")
+                        output.flush()
+                        if output is not sys.stdout:
+                            sys.stderr.write(describe(result) + "\n")
+    if output is not sys.stdout:
+        output.close()
+
+if __name__ == "__main__":
+    main()
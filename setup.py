@@ -28,12 +28,12 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import re
+
 from setuptools import setup
 
 def get_version():
-    g = {}
-    exec(open("vegascope.py").read(), g)
-    return g["__version__"]
+    return re.search(r'^__version__ = "([^"]*)"', open("vegascope.py").read(), re.M).group(1)
 
 def get_description():
     return open("README.rst", "rb").read().decode("utf8", "ignore").strip()